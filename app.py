@@ -1,5 +1,5 @@
 # app.py
-from flask import Flask, render_template, request, redirect, url_for, session, flash, make_response, current_app
+from flask import Flask, render_template, request, redirect, url_for, session, flash, make_response, current_app, g
 from flask_socketio import SocketIO
 from datetime import datetime, timedelta
 from xhtml2pdf import pisa
@@ -13,17 +13,185 @@ import json
 import os
 import random
 import hashlib
+import cProfile
+import pstats
+import time
+import functools
+import threading
+from collections import OrderedDict, deque
 
 
 # ------------------ Config ------------------
 DB_PATH = os.path.join(os.path.dirname(__file__), "mttc.db")
 TOKEN_VALIDITY_MINUTES = 30  # token expires after 30 minutes
 
+# Opt-in profiling: MTTC_PROFILE=1 samples a fraction of requests / socket events,
+# tutors can force a single request with the X-MTTC-Profile: 1 header.
+# Under eventlet every greenlet shares one thread, so a sample also records whatever
+# other requests/handlers run while it is waiting, and its "seconds" include that time.
+PROFILE_ENABLED = os.environ.get("MTTC_PROFILE", "0") == "1"
+PROFILE_SAMPLE_RATE = float(os.environ.get("MTTC_PROFILE_SAMPLE_RATE", "0.05"))
+PROFILE_DIR = os.environ.get("MTTC_PROFILE_DIR", os.path.join(os.path.dirname(__file__), "profiles"))
+PROFILE_TOP_N = int(os.environ.get("MTTC_PROFILE_TOP_N", "20"))
+PROFILE_HEADER = "X-MTTC-Profile"
+
+# Sliding-window rate limits for POSTs: endpoint -> key kind -> (max requests, window seconds).
+# IP limits are looser because a whole classroom can share one address.
+RATE_LIMITS = {
+    'trainee_token_page': {'username': (5, 60), 'device': (10, 60), 'ip': (120, 60)},
+    'mark_present_page': {'username': (3, 60), 'device': (5, 60), 'ip': (120, 60)},
+}
+RATE_LIMIT_MAX_KEYS = 10000  # oldest keys are evicted beyond this
+
 app = Flask(__name__, template_folder="templates")
 app.secret_key = 'your_secret_key'
 socketio = SocketIO(app)
 
+# ------------------ Profiling helpers ------------------
+slowest_calls = []  # rolling top-N of sampled calls, slowest first; only these keep files on disk
+slowest_calls_lock = threading.Lock()
+profile_active = False  # only one cProfile hook can be installed per thread
+
+def start_profile():
+    global profile_active
+    if profile_active:
+        return None
+    profile_active = True
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+def frame_label(func):
+    filename, lineno, name = func
+    if filename == '~':
+        label = name
+    else:
+        label = f"{os.path.basename(filename)}:{name}:{lineno}"
+    return label.replace(';', ':')
+
+# Approximate collapsed stacks (flamegraph.pl format): each function's own time goes
+# on a single stack built by following its heaviest caller, so cost stays linear.
+def collapse_stats(stats):
+    folded = {}
+    for func, (cc, nc, tt, ct, callers) in stats.stats.items():
+        weight = int(tt * 1_000_000)  # microseconds
+        if weight <= 0:
+            continue
+        path = [func]
+        while len(path) < 64:
+            callers = {c: edge for c, edge in stats.stats[path[-1]][4].items() if c not in path}
+            if not callers:
+                break
+            path.append(max(callers, key=lambda c: callers[c][3]))
+        stack = ';'.join(frame_label(f) for f in reversed(path))
+        folded[stack] = folded.get(stack, 0) + weight
+    return folded
+
+def remove_profile_files(entry):
+    for path in (entry["profile"], entry["flamegraph"]):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            app.logger.warning("Profiler could not remove %s: %s", path, e)
+
+def save_profile(profiler, entry, evicted):
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        stats = pstats.Stats(profiler)
+        stats.dump_stats(entry["profile"])
+        with open(entry["flamegraph"], "w") as f:
+            for stack, weight in collapse_stats(stats).items():
+                f.write(f"{stack} {weight}\n")
+        top_funcs = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:5]
+
+        with slowest_calls_lock:
+            entry["top_functions"] = [{"function": frame_label(func), "cumulative": round(st[3], 6)}
+                                      for func, st in top_funcs]
+            kept = entry in slowest_calls
+            with open(os.path.join(PROFILE_DIR, "slowest.json"), "w") as f:
+                json.dump(slowest_calls, f, indent=2)
+        # a slower sample may have pushed this one out while it was being written
+        if not kept:
+            remove_profile_files(entry)
+    except OSError as e:
+        app.logger.warning("Profiler could not write report: %s", e)
+
+    for old in evicted:
+        remove_profile_files(old)
+
+def finish_profile(profiler, label, started):
+    global profile_active
+    profiler.disable()
+    profile_active = False
+    elapsed = time.perf_counter() - started
+
+    with slowest_calls_lock:
+        # not slower than anything in the report: nothing to keep
+        if len(slowest_calls) >= PROFILE_TOP_N and elapsed <= slowest_calls[-1]["seconds"]:
+            return None
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+        safe_label = ''.join(ch if ch.isalnum() or ch in '._-' else '_' for ch in label)
+        base = os.path.join(PROFILE_DIR, f"{stamp}_{safe_label}")
+        entry = {
+            "label": label,
+            "seconds": round(elapsed, 6),
+            "time": datetime.now().isoformat(),
+            "profile": base + ".prof",
+            "flamegraph": base + ".folded",
+            "top_functions": []
+        }
+        slowest_calls.append(entry)
+        slowest_calls.sort(key=lambda c: c["seconds"], reverse=True)
+        evicted = slowest_calls[PROFILE_TOP_N:]
+        del slowest_calls[PROFILE_TOP_N:]
+
+    # pstats, file writes and stack collapsing run on a real OS thread so the
+    # eventlet loop keeps serving other classrooms meanwhile
+    worker = threading.Thread(target=save_profile, args=(profiler, entry, evicted), daemon=True)
+    worker.start()
+    return worker
+
+def profiled(handler):
+    # Sample Socket.IO handlers the same way requests are sampled
+    @functools.wraps(handler)
+    def wrapper(*args, **kwargs):
+        if not PROFILE_ENABLED or random.random() >= PROFILE_SAMPLE_RATE:
+            return handler(*args, **kwargs)
+        profiler = start_profile()
+        if profiler is None:
+            return handler(*args, **kwargs)
+        started = time.perf_counter()
+        try:
+            return handler(*args, **kwargs)
+        finally:
+            finish_profile(profiler, f"socketio.{handler.__name__}", started)
+    return wrapper
+
+@app.before_request
+def start_request_profile():
+    forced = PROFILE_HEADER in request.headers
+    if not PROFILE_ENABLED and not forced:
+        return
+    if forced and request.headers.get(PROFILE_HEADER) == "1" and session.get('role') == 'tutor':
+        sampled = True
+    else:
+        sampled = PROFILE_ENABLED and random.random() < PROFILE_SAMPLE_RATE
+    if sampled:
+        profiler = start_profile()
+        if profiler is not None:
+            g.profiler = profiler
+            g.profile_started = time.perf_counter()
+
+@app.teardown_request
+def stop_request_profile(exc):
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        finish_profile(profiler, request.endpoint or request.path, g.pop('profile_started'))
+
 @socketio.on('join_room')
+@profiled
 def handle_join_room(data):
     room = data.get('room')
     join_room(room)
@@ -84,6 +252,7 @@ attendance_history = []
 
 # Trainee joins their private room for live token updates
 @socketio.on('join_room')
+@profiled
 def join_personal_room(data):
     room = data.get('room')
     join_room(room)
@@ -91,6 +260,7 @@ def join_personal_room(data):
 
 # Optional: tutor joins class room to get updates on attendance
 @socketio.on('join_class')
+@profiled
 def join_class_room(data):
     room = data.get('class')
     join_room(room)
@@ -170,6 +340,56 @@ def generate_device_hash(request):
     return hashlib.sha256(raw.encode()).hexdigest()
 
 
+# ------------------ Rate limiting ------------------
+rate_limit_hits = OrderedDict()  # (endpoint, kind, value) -> deque of request timestamps
+
+# Return the pruned hit deque for key and the seconds to wait if it is full (else 0)
+def rate_limit_window(key, limit, window, now):
+    hits = rate_limit_hits.get(key)
+    if hits is None:
+        hits = rate_limit_hits[key] = deque(maxlen=limit)
+        if len(rate_limit_hits) > RATE_LIMIT_MAX_KEYS:
+            rate_limit_hits.popitem(last=False)
+    else:
+        rate_limit_hits.move_to_end(key)
+    while hits and hits[0] <= now - window:
+        hits.popleft()
+    if len(hits) >= limit:
+        return hits, window - (now - hits[0])
+    return hits, 0
+
+@app.before_request
+def enforce_rate_limits():
+    limits = RATE_LIMITS.get(request.endpoint)
+    if limits is None or request.method != 'POST':
+        return
+
+    # Check every key before recording anything, so a request blocked on one key
+    # does not use up the others (e.g. the IP window shared by a classroom).
+    # Cheapest keys first so floods are rejected before the session cookie is decoded.
+    now = time.monotonic()
+    windows = []
+    for kind in ('ip', 'device', 'username'):
+        if kind not in limits:
+            continue
+        if kind == 'ip':
+            value = request.remote_addr or ''
+        elif kind == 'device':
+            value = generate_device_hash(request)
+        else:
+            value = session.get('username')
+            if not value:
+                continue
+        limit, window = limits[kind]
+        hits, retry_after = rate_limit_window((request.endpoint, kind, value), limit, window, now)
+        if retry_after:
+            return make_response("Too many requests. Please wait and try again.", 429,
+                                 {'Retry-After': str(int(retry_after) + 1)})
+        windows.append(hits)
+
+    for hits in windows:
+        hits.append(now)
+
 # ------------------ Auth ------------------
 @app.route('/', methods=['GET', 'POST'])
 def login():
@@ -655,6 +875,7 @@ def mark_present_page():
 
 # When trainee connects to listen for their class tokens
 @socketio.on('join_class')
+@profiled
 def handle_join_class(data):
     trainee_class = data.get('class')
     if trainee_class:
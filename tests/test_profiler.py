@@ -0,0 +1,81 @@
+import cProfile
+import json
+import pstats
+import time
+
+import pytest
+
+import app as mttc
+
+
+@pytest.fixture
+def profile_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(mttc, 'PROFILE_DIR', str(tmp_path))
+    monkeypatch.setattr(mttc, 'PROFILE_TOP_N', 2)
+    monkeypatch.setattr(mttc, 'profile_active', False)
+    mttc.slowest_calls.clear()
+    yield tmp_path
+    mttc.slowest_calls.clear()
+
+
+def sample(label, seconds):
+    profiler = mttc.start_profile()
+    assert profiler is not None
+    worker = mttc.finish_profile(profiler, label, time.perf_counter() - seconds)
+    if worker is not None:
+        worker.join()
+
+
+def test_report_keeps_top_n_and_removes_old_files(profile_dir):
+    for i, seconds in enumerate([1, 5, 2, 4, 3]):
+        sample(f'call{i}', seconds)
+
+    report = json.loads((profile_dir / 'slowest.json').read_text())
+    assert [c['label'] for c in report] == ['call1', 'call3']
+    assert report[0]['top_functions']
+
+    kept = sorted(p.name for p in profile_dir.iterdir() if p.name != 'slowest.json')
+    assert len(kept) == 4
+    assert all('call1' in name or 'call3' in name for name in kept)
+
+
+def test_only_one_profile_at_a_time(profile_dir):
+    profiler = mttc.start_profile()
+    assert mttc.start_profile() is None
+    mttc.finish_profile(profiler, 'outer', time.perf_counter()).join()
+    second = mttc.start_profile()
+    assert second is not None
+    second.disable()
+
+
+def inner():
+    return sum(range(50000))
+
+
+def outer():
+    return inner()
+
+
+def test_collapse_stats_follows_callers():
+    profiler = cProfile.Profile()
+    profiler.enable()
+    outer()
+    profiler.disable()
+
+    stacks = mttc.collapse_stats(pstats.Stats(profiler))
+    assert any('test_profiler.py:outer' in stack and stack.split(';')[-1].startswith('<built-in method builtins.sum>')
+               for stack in stacks)
+
+
+@pytest.mark.parametrize('role, profiled', [('trainee', False), ('tutor', True)])
+def test_profile_header_is_tutor_only(monkeypatch, role, profiled):
+    started = []
+    monkeypatch.setattr(mttc, 'PROFILE_ENABLED', False)
+    monkeypatch.setattr(mttc, 'start_profile', lambda: started.append(True))
+    mttc.app.config['TESTING'] = True
+    with mttc.app.test_client() as client:
+        with client.session_transaction() as sess:
+            sess['role'] = role
+        client.get('/logout', headers={mttc.PROFILE_HEADER: '1'})
+
+    assert bool(started) is profiled
@@ -0,0 +1,77 @@
+import pytest
+
+import app as mttc
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setitem(mttc.RATE_LIMITS, 'mark_present_page',
+                        {'username': (3, 60), 'device': (2, 60), 'ip': (5, 60)})
+    mttc.rate_limit_hits.clear()
+    mttc.app.config['TESTING'] = True
+    with mttc.app.test_client() as client:
+        yield client
+    mttc.rate_limit_hits.clear()
+
+
+def device_hash(user_agent):
+    with mttc.app.test_request_context(headers={'User-Agent': user_agent},
+                                       environ_base={'REMOTE_ADDR': '127.0.0.1'}):
+        return mttc.generate_device_hash(mttc.request)
+
+
+def post_from(client, user_agent):
+    return client.post('/trainee/mark_present', headers={'User-Agent': user_agent})
+
+
+def test_device_limit_returns_429(client):
+    assert post_from(client, 'device-a').status_code == 302
+    assert post_from(client, 'device-a').status_code == 302
+    response = post_from(client, 'device-a')
+    assert response.status_code == 429
+    assert int(response.headers['Retry-After']) > 0
+
+
+def test_blocked_device_does_not_use_up_ip_budget(client):
+    for _ in range(20):
+        post_from(client, 'script')
+
+    # same IP, different device: the script's rejected requests must not count
+    assert post_from(client, 'classmate-1').status_code == 302
+    assert post_from(client, 'classmate-2').status_code == 302
+
+
+def test_ip_limit_applies_across_devices(client):
+    for i in range(5):
+        assert post_from(client, f'device-{i}').status_code == 302
+    assert post_from(client, 'device-5').status_code == 429
+
+
+def test_username_limit_on_token_page(client):
+    with client.session_transaction() as sess:
+        sess['role'] = 'trainee'
+        sess['username'] = 'trainee1'
+        sess['full_name'] = 'Trainee One'
+
+    # a new device per attempt, so only the username window can trip
+    codes = [client.post('/trainee/token', data={'token': '0000'},
+                         headers={'User-Agent': f'device-{i}'}).status_code
+             for i in range(8)]
+    assert codes[:5] == [302] * 5
+    assert codes[5:] == [429] * 3
+
+
+def test_get_requests_are_never_limited(client):
+    for _ in range(20):
+        assert client.get('/trainee/token', headers={'User-Agent': 'device-a'}).status_code != 429
+
+
+def test_oldest_keys_are_evicted(client, monkeypatch):
+    monkeypatch.setattr(mttc, 'RATE_LIMIT_MAX_KEYS', 3)
+    for i in range(5):
+        post_from(client, f'device-{i}')
+
+    assert len(mttc.rate_limit_hits) == 3
+    assert ('mark_present_page', 'ip', '127.0.0.1') in mttc.rate_limit_hits
+    devices = [key[2] for key in mttc.rate_limit_hits if key[1] == 'device']
+    assert devices == [device_hash('device-3'), device_hash('device-4')]